@@ -0,0 +1,516 @@
+#!/usr/bin/env python3
+"""
+server.py — ECLIA memory embedding sidecar (FastAPI)
+
+Local-only companion service for the memory app: turns memory texts into
+sentence-embedding vectors so the TS side can do similarity lookups without
+pulling torch into Node.
+
+Contract (mirrors the other ECLIA sidecars):
+- Binds to 127.0.0.1; the gateway proxies requests to it.
+- JSON in/out with an `ok` status field.
+
+Endpoints:
+  GET  /health          liveness + whether model weights are cached
+  GET  /model/status    model name + cache state
+  POST /model/download  fetch model weights into the HF cache
+  POST /model/delete    drop cached model weights
+  POST /embed           {texts: [...], normalize: bool} -> {embeddings: [[...]]}
+  POST /embed_bin       same request; msgpack body with raw float32 bytes
+
+Env:
+  ECLIA_EMB_MODEL      model id (default: sentence-transformers/all-MiniLM-L6-v2)
+  ECLIA_EMB_HOST       bind host (default: 127.0.0.1)
+  ECLIA_EMB_PORT       bind port (default: 8789)
+  ECLIA_EMB_THREADS    torch intra-op threads (default: cpu count)
+  ECLIA_EMB_QUANT      "int8" to dynamically quantize Linear layers (default: off)
+  ECLIA_EMB_BACKEND    "onnx" to run via ONNX Runtime with fused kernels
+                       (needs sentence-transformers[onnx]; default: torch)
+  ECLIA_EMB_MAX_BATCH  max texts coalesced into one forward pass (default: 256)
+  ECLIA_EMB_WORKERS    uvicorn worker processes; each loads its own model copy
+                       (default: 1)
+  ECLIA_EMB_CACHE_SIZE embedding LRU entries, 0 disables (default: 10000)
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import functools
+import hashlib
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Literal
+
+import numpy as np
+import orjson
+import ormsgpack
+from fastapi import FastAPI, HTTPException, Response
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+
+# torch / sentence-transformers are deliberately NOT imported here: they cost
+# multiple seconds of import time, and /health or /model/status should not pay
+# that. The model stack loads on the first /embed via _ensure_model_loaded().
+
+MODEL_NAME = os.environ.get("ECLIA_EMB_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+HOST = os.environ.get("ECLIA_EMB_HOST", "127.0.0.1")
+PORT = int(os.environ.get("ECLIA_EMB_PORT", "8789"))
+BACKEND = os.environ.get("ECLIA_EMB_BACKEND", "torch").strip().lower()
+
+
+@functools.lru_cache(maxsize=1)
+def _hf_cache_dir() -> Path:
+    env = os.environ.get("HF_HOME")
+    if env:
+        return Path(env).expanduser()
+    return Path.home() / ".cache" / "huggingface"
+
+
+@functools.lru_cache(maxsize=1)
+def _model_cache_path() -> Path:
+    return _hf_cache_dir() / "hub" / ("models--" + MODEL_NAME.replace("/", "--"))
+
+
+# /health gets polled by liveness checks; cache the on-disk answer briefly so
+# polling doesn't hit the filesystem every time. Download/delete invalidate.
+_CACHED_TTL_SEC = 5.0
+_cached_state: tuple[bool, float] | None = None
+
+
+def _is_model_cached() -> bool:
+    global _cached_state
+    now = time.monotonic()
+    if _cached_state is not None and now - _cached_state[1] < _CACHED_TTL_SEC:
+        return _cached_state[0]
+    snapshots = _model_cache_path() / "snapshots"
+    # os.scandir stops at the first entry without allocating a Path per child
+    # the way iterdir() does.
+    try:
+        with os.scandir(snapshots) as it:
+            result = next(it, None) is not None
+    except (FileNotFoundError, NotADirectoryError):
+        result = False
+    _cached_state = (result, now)
+    return result
+
+
+def _invalidate_cached_state() -> None:
+    global _cached_state
+    _cached_state = None
+
+
+def _cpu_flags() -> set[str]:
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("flags"):
+                    return set(line.split(":", 1)[1].split())
+    except OSError:
+        pass
+    return set()
+
+
+def _physical_cpu_count() -> int:
+    """Physical core count from /proc/cpuinfo (os.cpu_count counts HT siblings).
+
+    Hyper-thread siblings share execution ports, so intra-op threads beyond
+    physical cores only add contention for GEMM-heavy inference.
+    """
+    cores: set[tuple[str, str]] = set()
+    phys = ""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("physical id"):
+                    phys = line.split(":", 1)[1].strip()
+                elif line.startswith("core id"):
+                    cores.add((phys, line.split(":", 1)[1].strip()))
+    except OSError:
+        pass
+    return len(cores) or (os.cpu_count() or 1)
+
+
+def _maybe_quantize(model: SentenceTransformer) -> bool:
+    """Dynamically quantize the transformer's Linear layers to INT8.
+
+    Only worthwhile on CPUs with VNNI (vpdpbusd); on older cores INT8 can be
+    slower than FP32, so require the avx512_vnni flag and a quantized engine
+    before swapping the weights. Returns True if quantization was applied.
+    """
+    import torch
+
+    if os.environ.get("ECLIA_EMB_QUANT", "").strip().lower() != "int8":
+        return False
+    if not torch.backends.quantized.supported_engines:
+        print("[memory-embed] int8 requested but no quantized engine available; staying fp32")
+        return False
+    if "avx512_vnni" not in _cpu_flags():
+        print("[memory-embed] int8 requested but CPU lacks avx512_vnni; staying fp32")
+        return False
+    try:
+        model[0].auto_model = torch.quantization.quantize_dynamic(
+            model[0].auto_model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+        return True
+    except Exception as ex:
+        print(f"[memory-embed] int8 quantization failed ({ex}); staying fp32")
+        return False
+
+
+app = FastAPI(title="eclia-memory-embed")
+
+
+def _load_model() -> SentenceTransformer:
+    """Load the model on the configured backend.
+
+    The onnx backend exports once into the HF cache and runs via ONNX Runtime
+    with graph_optimization_level=ALL, fusing LayerNorm/GELU/attention into
+    single kernels — typically 2-4x CPU throughput over eager torch for
+    MiniLM-class encoders. Falls back to torch if the onnx extras are missing.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    if BACKEND == "onnx":
+        try:
+            import onnxruntime as ort
+
+            so = ort.SessionOptions()
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            so.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+            so.intra_op_num_threads = _physical_cpu_count()
+            # Log the INT8 capability probe so users can tell why quantization
+            # was or wasn't worthwhile on this host (INT8 without VNNI/AMX is
+            # usually slower than FP32).
+            flags = _cpu_flags()
+            print(
+                f"[memory-embed] onnx: intra_op_threads={so.intra_op_num_threads}"
+                f" vnni={'avx512_vnni' in flags} amx_int8={'amx_int8' in flags}"
+            )
+            return SentenceTransformer(
+                MODEL_NAME,
+                backend="onnx",
+                model_kwargs={"session_options": so, "provider": "CPUExecutionProvider"},
+            )
+        except Exception as ex:
+            print(f"[memory-embed] onnx backend unavailable ({ex}); falling back to torch")
+    return SentenceTransformer(MODEL_NAME)
+
+
+_model: SentenceTransformer | None = None
+_quantized = False
+_model_lock = threading.Lock()
+
+
+def _prefetch_model_files() -> None:
+    """Hint the kernel to page in cached snapshot files (POSIX only).
+
+    Issued at startup so the weights stream from disk in parallel with the
+    torch/transformers import that the first /embed will trigger.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    snapshots = _model_cache_path() / "snapshots"
+    for root, _dirs, files in os.walk(snapshots):
+        for name in files:
+            try:
+                fd = os.open(os.path.join(root, name), os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, os.fstat(fd).st_size, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except OSError:
+                continue
+
+
+def _ensure_model_loaded() -> SentenceTransformer:
+    """Load model + torch on first use; /health stays import-free."""
+    global _model, _quantized
+    if _model is not None:
+        return _model
+    with _model_lock:
+        if _model is not None:
+            return _model
+        import torch
+
+        torch.set_num_threads(int(os.environ.get("ECLIA_EMB_THREADS", os.cpu_count() or 1)))
+        torch.set_grad_enabled(False)  # inference-only service; never build autograd graphs
+        model = _load_model()
+        # Dynamic torch quantization only applies to the eager torch module graph.
+        quantized = _maybe_quantize(model) if model.backend == "torch" else False
+        # Throwaway encode: torch resolves dispatcher paths and oneDNN GEMM
+        # plans on the first call, so warm them as part of the load.
+        model.encode(["warmup"] * 2, normalize_embeddings=True, batch_size=2)
+        _quantized = quantized
+        _model = model
+    return _model
+
+
+# -- Micro-batching ----------------------------------------------------------
+# Concurrent /embed calls are coalesced into one forward pass: one
+# (batch, seq, hidden) GEMM beats N single-row passes, and the ~5 ms window is
+# well below model time. Each entry is (texts, normalize, future).
+
+BATCH_WINDOW_SEC = 0.005
+MAX_BATCH = int(os.environ.get("ECLIA_EMB_MAX_BATCH", "256"))
+
+_embed_queue: asyncio.Queue | None = None
+
+
+# LRU of already-computed rows. Chatty callers re-embed the same boilerplate
+# (system prompts, templates) constantly; a hit costs a dict lookup instead of
+# ~10 ms of forward pass. Keyed by text digest so long texts don't pin RAM.
+EMB_CACHE_SIZE = int(os.environ.get("ECLIA_EMB_CACHE_SIZE", "10000"))
+_emb_cache: OrderedDict[tuple[bytes, bool], np.ndarray] = OrderedDict()
+
+
+def _cache_key(text: str, normalize: bool) -> tuple[bytes, bool]:
+    return (hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest(), normalize)
+
+
+def _encode_batch(texts: List[str], normalize: bool) -> np.ndarray:
+    """Run one batched forward pass over cache misses, length-sorted.
+
+    Cached rows are served straight from the LRU. The remaining texts are
+    sorted by length before encoding — encode() pads each internal batch to
+    its longest member, so one long outlier would otherwise waste compute on
+    every other row — then scattered back into input order.
+    """
+    keys = [_cache_key(t, normalize) for t in texts]
+    rows: List[np.ndarray | None] = [None] * len(texts)
+    miss_idx: List[int] = []
+    for i, key in enumerate(keys):
+        cached = _emb_cache.get(key)
+        if cached is not None:
+            _emb_cache.move_to_end(key)
+            rows[i] = cached
+        else:
+            miss_idx.append(i)
+
+    if miss_idx:
+        model = _ensure_model_loaded()
+        import torch
+
+        miss_texts = [texts[i] for i in miss_idx]
+        order = np.argsort([len(t) for t in miss_texts], kind="stable")
+        sorted_texts = [miss_texts[i] for i in order]
+        # inference_mode is stricter than no_grad: it also skips view tracking
+        # and version-counter bumps, worth ~5-15% on CPU transformer forwards.
+        with torch.inference_mode():
+            vecs_sorted = model.encode(
+                sorted_texts,
+                batch_size=128,
+                normalize_embeddings=normalize,
+                convert_to_numpy=True,
+            )
+        vecs_miss = np.empty_like(vecs_sorted)
+        vecs_miss[order] = vecs_sorted
+        for j, i in enumerate(miss_idx):
+            rows[i] = vecs_miss[j]
+            if EMB_CACHE_SIZE > 0:
+                _emb_cache[keys[i]] = vecs_miss[j]
+        while len(_emb_cache) > EMB_CACHE_SIZE:
+            _emb_cache.popitem(last=False)
+
+    return np.stack(rows)
+
+
+async def _embed_worker() -> None:
+    assert _embed_queue is not None
+    while True:
+        batch = [await _embed_queue.get()]
+        total = len(batch[0][0])
+        while total < MAX_BATCH:
+            try:
+                item = await asyncio.wait_for(_embed_queue.get(), timeout=BATCH_WINDOW_SEC)
+            except asyncio.TimeoutError:
+                break
+            batch.append(item)
+            total += len(item[0])
+
+        # Requests with different normalize flags cannot share an encode call;
+        # in practice everything lands in the normalize=True group.
+        for normalize in (True, False):
+            group = [(texts, fut) for texts, n, fut in batch if n is normalize]
+            if not group:
+                continue
+            flat = [t for texts, _ in group for t in texts]
+            try:
+                vecs = await asyncio.to_thread(_encode_batch, flat, normalize)
+            except Exception as ex:
+                for _, fut in group:
+                    if not fut.done():
+                        fut.set_exception(ex)
+                continue
+            offset = 0
+            for texts, fut in group:
+                if not fut.done():
+                    fut.set_result(vecs[offset : offset + len(texts)])
+                offset += len(texts)
+
+
+@app.on_event("startup")
+async def _start_embed_worker() -> None:
+    global _embed_queue
+    _embed_queue = asyncio.Queue()
+    asyncio.create_task(_embed_worker())
+    await asyncio.to_thread(_prefetch_model_files)
+
+
+class EmbedRequest(BaseModel):
+    texts: List[str]
+    normalize: bool = True
+    # fp16/int8 ship raw bytes (base64) instead of JSON floats: 2-4x smaller
+    # payloads, decoded client-side with np.frombuffer.
+    precision: Literal["fp32", "fp16", "int8"] = "fp32"
+
+
+@app.get("/health")
+def health():
+    return {
+        "ok": True,
+        "service": "memory-embed",
+        "model": MODEL_NAME,
+        "model_loaded": _model is not None,
+        "backend": _model.backend if _model is not None else None,
+        "cached": _is_model_cached(),
+        "quantized": _quantized,
+    }
+
+
+@app.get("/model/status")
+def model_status():
+    return {"ok": True, "model": MODEL_NAME, "cached": _is_model_cached(), "path": str(_model_cache_path())}
+
+
+@app.post("/model/download")
+def model_download():
+    from huggingface_hub import snapshot_download
+
+    try:
+        snapshot_download(MODEL_NAME)
+    except Exception as ex:
+        raise HTTPException(status_code=502, detail=f"Model download failed: {ex}")
+    _invalidate_cached_state()
+    # Freshly downloaded weights may differ from what produced cached rows.
+    _emb_cache.clear()
+    _ensure_model_loaded()
+    return {"ok": True, "model": MODEL_NAME, "cached": _is_model_cached()}
+
+
+@app.post("/model/delete")
+def model_delete():
+    path = _model_cache_path()
+    if path.is_dir():
+        shutil.rmtree(path)
+    _invalidate_cached_state()
+    return {"ok": True, "model": MODEL_NAME, "cached": _is_model_cached()}
+
+
+async def _embed_texts(texts: List[str], normalize: bool) -> np.ndarray:
+    """Hand texts to the coalescing worker and await the float32 rows."""
+    assert _embed_queue is not None
+    fut = asyncio.get_running_loop().create_future()
+    await _embed_queue.put((texts, normalize, fut))
+    vecs = await fut
+    return np.ascontiguousarray(vecs, dtype=np.float32)
+
+
+@app.post("/embed")
+async def embed(req: EmbedRequest):
+    # Pydantic already coerced texts to List[str]; no defensive re-cast needed.
+    texts = req.texts or []
+    if not texts:
+        raise HTTPException(status_code=400, detail="texts must be a non-empty list")
+    vecs = await _embed_texts(texts, req.normalize)
+
+    if req.precision != "fp32":
+        if req.precision == "fp16":
+            vecs = vecs.astype(np.float16)
+        else:
+            from sentence_transformers import quantize_embeddings
+
+            vecs = quantize_embeddings(vecs, precision="int8", calibration_embeddings=vecs)
+        body = orjson.dumps(
+            {
+                "ok": True,
+                "model": MODEL_NAME,
+                "dtype": str(vecs.dtype),
+                "shape": list(vecs.shape),
+                "embeddings_b64": base64.b64encode(vecs.tobytes()).decode("ascii"),
+            }
+        )
+        return Response(content=body, media_type="application/json")
+
+    # Serialize the numpy matrix directly with orjson instead of tolist() +
+    # Pydantic: skips one PyFloat allocation per element and the per-entry
+    # response validation, which dominates at larger batch sizes.
+    body = orjson.dumps(
+        {"ok": True, "model": MODEL_NAME, "dim": int(vecs.shape[1]), "embeddings": vecs},
+        option=orjson.OPT_SERIALIZE_NUMPY,
+    )
+    return Response(content=body, media_type="application/json")
+
+
+@app.post("/embed_bin")
+async def embed_bin(req: EmbedRequest):
+    """Binary variant of /embed: msgpack with raw float32 bytes.
+
+    JSON costs ~14 ASCII bytes per float vs 4 raw; for dim=384 batches the
+    msgpack body is ~3x smaller and skips float formatting entirely. Clients
+    reconstruct with np.frombuffer(msg["data"], np.float32).reshape(n, dim).
+    """
+    texts = req.texts or []
+    if not texts:
+        raise HTTPException(status_code=400, detail="texts must be a non-empty list")
+    vecs = await _embed_texts(texts, req.normalize)
+    body = ormsgpack.packb(
+        {
+            "ok": True,
+            "model": MODEL_NAME,
+            "n": int(vecs.shape[0]),
+            "dim": int(vecs.shape[1]),
+            "dtype": "f4",
+            "data": vecs.tobytes(),
+        }
+    )
+    return Response(content=body, media_type="application/msgpack")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    # Prefer the C event loop / parser when installed (they are in
+    # requirements.txt for POSIX); fall back to the pure-Python defaults so the
+    # sidecar still starts on platforms without them.
+    try:
+        import uvloop  # noqa: F401
+
+        loop = "uvloop"
+    except ImportError:
+        loop = "asyncio"
+    try:
+        import httptools  # noqa: F401
+
+        http_impl = "httptools"
+    except ImportError:
+        http_impl = "h11"
+
+    workers = int(os.environ.get("ECLIA_EMB_WORKERS", "1"))
+    if workers > 1:
+        # Multi-worker mode needs an import string; each worker process
+        # re-imports this module and loads its own model (budget model RAM x
+        # workers). The torch forward pass releases the GIL, so extra workers
+        # mainly buy HTTP/serialization parallelism.
+        uvicorn.run(
+            "apps.memory.sidecar.server:app",
+            host=HOST, port=PORT, loop=loop, http=http_impl,
+            workers=workers, log_level="info",
+        )
+    else:
+        uvicorn.run(app, host=HOST, port=PORT, loop=loop, http=http_impl, log_level="info")
@@ -25,16 +25,30 @@ Template lookup fallbacks (if --template is not absolute):
 from __future__ import annotations
 
 import argparse
-import base64
-import datetime as _dt
+import binascii
+import http.client
 import json
 import os
 import sys
-import urllib.error
-import urllib.request
+import time
+import urllib.parse
 from pathlib import Path
 from typing import Any, Dict, List
 
+try:
+    import orjson  # optional C-accelerated JSON; stdlib json is the fallback
+except ImportError:
+    orjson = None  # type: ignore[assignment]
+
+try:
+    import pybase64  # optional SIMD base64 (SSSE3/AVX2); stdlib is the fallback
+except ImportError:
+    pybase64 = None  # type: ignore[assignment]
+
+# a2b_base64 decodes ASCII str input directly, skipping base64.b64decode's
+# internal str -> bytes copy and alphabet-translation pass.
+_b64decode = pybase64.b64decode if pybase64 is not None else binascii.a2b_base64
+
 
 EXIT_ARG = 2
 EXIT_RUN = 1
@@ -93,7 +107,13 @@ def build_out_path(out_dir: Path, out_arg: str | None) -> Path:
         else:
             out_path = out_dir / out_arg
     else:
-        ts = _dt.datetime.now().strftime("%Y%m%d_%H%M%S")
+        # Cheaper than datetime.now().strftime: no datetime allocation and no
+        # strftime format/locale machinery, which adds up in tight batch loops.
+        lt = time.localtime()
+        ts = (
+            f"{lt.tm_year:04d}{lt.tm_mon:02d}{lt.tm_mday:02d}"
+            f"_{lt.tm_hour:02d}{lt.tm_min:02d}{lt.tm_sec:02d}"
+        )
         out_path = out_dir / f"out_{ts}.png"
 
     try:
@@ -104,8 +124,11 @@ def build_out_path(out_dir: Path, out_arg: str | None) -> Path:
 
 def load_json(path: Path) -> Dict[str, Any]:
     try:
-        with path.open("r", encoding="utf-8") as f:
-            obj = json.load(f)
+        with path.open("rb") as f:
+            raw = f.read()
+        # orjson.JSONDecodeError subclasses json.JSONDecodeError, so the
+        # except clause below covers both parsers.
+        obj = orjson.loads(raw) if orjson is not None else json.loads(raw)
     except json.JSONDecodeError as ex:
         raise ValueError(f"Failed to parse JSON: {path}\n{ex}") from ex
     if not isinstance(obj, dict):
@@ -169,46 +192,96 @@ def apply_seed_override(tpl: Dict[str, Any], seed_raw: str | None) -> None:
         tpl["seed"] = s
 
 
+# Keep-alive connections reused across calls within one process, keyed by
+# scheme://host:port. Saves a TCP (and TLS) handshake per request when the
+# script is driven in a loop or retries.
+_connections: Dict[str, http.client.HTTPConnection] = {}
+
+
+def _get_connection(scheme: str, host: str, port: int, timeout_sec: int) -> http.client.HTTPConnection:
+    key = f"{scheme}://{host}:{port}"
+    conn = _connections.get(key)
+    if conn is None:
+        cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        conn = cls(host, port, timeout=timeout_sec)
+        _connections[key] = conn
+    return conn
+
+
 def http_post_json(url: str, payload: Dict[str, Any], timeout_sec: int = 60 * 60) -> bytes:
-    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-    req = urllib.request.Request(
-        url=url,
-        data=data,
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
+    if orjson is not None:
+        data = orjson.dumps(payload)  # returns bytes directly
+    else:
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+
+    u = urllib.parse.urlsplit(url)
+    scheme = u.scheme or "http"
+    host = u.hostname or "127.0.0.1"
+    port = u.port or (443 if scheme == "https" else 80)
+    path = u.path or "/"
+    if u.query:
+        path += "?" + u.query
+
+    headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+    conn = _get_connection(scheme, host, port, timeout_sec)
     try:
-        with urllib.request.urlopen(req, timeout=timeout_sec) as resp:
-            return resp.read()
-    except urllib.error.HTTPError as ex:
-        body = ex.read() if hasattr(ex, "read") else b""
+        try:
+            conn.request("POST", path, body=data, headers=headers)
+            resp = conn.getresponse()
+        except (http.client.HTTPException, ConnectionError, BrokenPipeError):
+            # Stale keep-alive socket (e.g. server restarted or idled out):
+            # retry exactly once on a fresh connection.
+            conn.close()
+            conn.request("POST", path, body=data, headers=headers)
+            resp = conn.getresponse()
+        body = resp.read()
+    except OSError as ex:
+        conn.close()
+        raise RuntimeError(f"HTTP request failed: {ex}") from ex
+
+    if resp.status >= 400:
         preview = body[:400].decode("utf-8", errors="replace")
-        raise RuntimeError(f"HTTP {ex.code} {ex.reason}\nResponse preview (first 400 chars):\n{preview}") from ex
-    except urllib.error.URLError as ex:
-        raise RuntimeError(f"HTTP request failed: {ex.reason}") from ex
+        raise RuntimeError(f"HTTP {resp.status} {resp.reason}\nResponse preview (first 400 chars):\n{preview}")
+    return body
 
 
 def parse_response(body: bytes) -> Dict[str, Any]:
     if not body:
         raise RuntimeError("No response body from server.")
     try:
-        return json.loads(body)
+        return orjson.loads(body) if orjson is not None else json.loads(body)
     except json.JSONDecodeError:
         preview = body[:400].decode("utf-8", errors="replace")
         raise RuntimeError("Non-JSON response from server (first 400 bytes):\n" + preview)
 
 
-def decode_image_b64(s: str) -> bytes:
+# Multiple of 4 so each chunk decodes independently (4 base64 chars -> 3 bytes).
+B64_CHUNK_CHARS = 1 << 16
+
+
+def _strip_data_uri(s: str) -> str:
     if s.startswith("data:image"):
-        s = s.split(",", 1)[1]
-    return base64.b64decode(s)
+        return s.split(",", 1)[1]
+    return s
+
+
+def write_image_b64(s: str, path: Path) -> None:
+    """Decode base64 image data straight to disk in chunks.
+
+    Avoids materializing the full decoded image next to its (larger) base64
+    source string — for multi-MB SDXL PNGs this roughly halves peak memory.
+    """
+    s = _strip_data_uri(s)
+    with path.open("wb") as f:
+        for i in range(0, len(s), B64_CHUNK_CHARS):
+            f.write(_b64decode(s[i : i + B64_CHUNK_CHARS]))
 
 
 def save_images(out_path: Path, images: List[str]) -> List[Path]:
     out_path.parent.mkdir(parents=True, exist_ok=True)
 
     if len(images) == 1:
-        out_path.write_bytes(decode_image_b64(images[0]))
+        write_image_b64(images[0], out_path)
         return [out_path]
 
     stem = out_path.stem
@@ -216,7 +289,7 @@ def save_images(out_path: Path, images: List[str]) -> List[Path]:
     saved: List[Path] = []
     for i, s in enumerate(images):
         p = out_path.with_name(f"{stem}_{i}{suffix}")
-        p.write_bytes(decode_image_b64(s))
+        write_image_b64(s, p)
         saved.append(p)
     return saved
 